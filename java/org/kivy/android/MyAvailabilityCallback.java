@@ -0,0 +1,43 @@
+package org.kivy.android;
+
+import android.hardware.camera2.CameraManager;
+import java.lang.Runnable;
+import android.util.Log;
+
+
+public class MyAvailabilityCallback extends CameraManager.AvailabilityCallback {
+	private static final String TAG = "pythonMyAvailabilityCallback";
+
+    Runnable callback;
+
+    private String camera_id = null;
+    private boolean camera_available = false;
+
+    public MyAvailabilityCallback(Runnable the_callback) {
+        callback = the_callback;
+    }
+
+    @Override
+    public void onCameraAvailable(String cameraId) {
+        Log.v(TAG, "onCameraAvailable " + cameraId);
+        this.camera_id = cameraId;
+        this.camera_available = true;
+        this.callback.run();
+    }
+
+    @Override
+    public void onCameraUnavailable(String cameraId) {
+        Log.v(TAG, "onCameraUnavailable " + cameraId);
+        this.camera_id = cameraId;
+        this.camera_available = false;
+        this.callback.run();
+    }
+
+    public String getCameraId() {
+        return camera_id;
+    }
+
+    public boolean isCameraAvailable() {
+        return camera_available;
+    }
+}
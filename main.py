@@ -1,7 +1,10 @@
+import asyncio
 import traceback
+from collections import deque, namedtuple
 from enum import Enum
 from gc import collect
 from math import degrees, isclose
+from time import perf_counter
 
 from android.permissions import Permission, request_permissions
 from jnius import PythonJavaClass, autoclass, cast, java_method
@@ -12,13 +15,16 @@ from kivy.graphics import Fbo, Rectangle
 from kivy.graphics.texture import Texture
 from kivy.lang import Builder
 from kivy.logger import Logger
-from kivy.properties import (BooleanProperty, ListProperty, NumericProperty,
+from kivy.properties import (BooleanProperty, DictProperty, ListProperty, NumericProperty,
                              ObjectProperty, OptionProperty, StringProperty)
 from kivy.uix.behaviors import ButtonBehavior
 from kivy.uix.relativelayout import RelativeLayout
 from kivy.uix.widget import Widget
 
-__all__ = ('Camera2Widget', 'Camera2Layout')
+from quality import QualityController
+
+__all__ = ('Camera2Widget', 'Camera2Layout', 'AsyncCameraDevice', 'AsyncCamera2',
+           'CameraError', 'CapturedFrame')
 
 ArrayList = autoclass('java.util.ArrayList')
 CameraCharacteristics = autoclass("android.hardware.camera2.CameraCharacteristics")
@@ -28,6 +34,7 @@ Context = autoclass("android.content.Context")
 GL_TEXTURE_EXTERNAL_OES = autoclass('android.opengl.GLES11Ext').GL_TEXTURE_EXTERNAL_OES
 Handler = autoclass("android.os.Handler")
 HandlerThread = autoclass('android.os.HandlerThread')
+MyAvailabilityCallback = autoclass("org.kivy.android.MyAvailabilityCallback")
 MyCaptureSessionCallback = autoclass("org.kivy.android.MyCaptureSessionCallback")
 MyStateCallback = autoclass("org.kivy.android.MyStateCallback")
 PythonActivity = autoclass("org.kivy.android.PythonActivity")
@@ -229,6 +236,21 @@ class TiltDetector(PythonJavaClass):
         self.SensorManager = None
 
 
+class ThermalMonitor:
+    """Reads the thermal status of PowerManager, always 0 (none) before API 29."""
+
+    def __init__(self):
+        context = PythonActivity.mActivity.getApplicationContext()
+        self.power_manager = cast('android.os.PowerManager',
+                                  context.getSystemService(Context.POWER_SERVICE))
+
+    def __call__(self):
+        try:
+            return self.power_manager.getCurrentThermalStatus()
+        except Exception:  # pylint: disable=broad-except
+            return 0
+
+
 def get_suitable_camera_size(resolutions):
     try:
         aspect_ratio_16_9 = [item for item in resolutions if isclose(item[0] / item[1], 16/9)]
@@ -238,6 +260,16 @@ def get_suitable_camera_size(resolutions):
         return resolutions[0]
 
 
+def get_scaled_camera_size(resolutions, resolution, scale):
+    """Largest size with the aspect ratio of `resolution` that fits
+    within `resolution` scaled by `scale`."""
+    width, height = resolution
+    candidates = [item for item in resolutions
+                  if isclose(item[0] / item[1], width / height)
+                  and item[0] <= width * scale and item[1] <= height * scale]
+    return tuple(max(candidates, default=resolution))
+
+
 class LensFacing(Enum):
     """Values copied from CameraCharacteristics api doc, as pyjnius
     lookup doesn't work on some devices.
@@ -255,6 +287,10 @@ class ControlAeMode(Enum):
     CONTROL_AE_MODE_ON = 1
 
 
+def _same_device(device, other):
+    return device is not None and other is not None and device.equals(other)
+
+
 class PyCameraInterface(EventDispatcher):
     """Provides an API for querying details of the cameras
     available on Android."""
@@ -299,11 +335,22 @@ class PyCameraInterface(EventDispatcher):
 
 
 class PyCameraDevice(EventDispatcher):  # pylint: disable=too-many-instance-attributes
-    __events__ = ('on_opened', 'on_closed', 'on_disconnected', 'on_error')
+    __events__ = ('on_opened', 'on_closed', 'on_disconnected', 'on_error', 'on_session_ready',
+                  'on_recovered', 'on_recovery_failed')
+    ae_mode = NumericProperty(ControlAeMode.CONTROL_AE_MODE_ON.value)
+    af_mode = NumericProperty(ControlAfMode.CONTROL_AF_MODE_CONTINUOUS_PICTURE.value)
+    auto_reconnect = BooleanProperty(True)
     camera_angle = NumericProperty()
     camera_id = StringProperty()
     flashlight = BooleanProperty(False)
     fps = NumericProperty(60)
+    last_recovery = DictProperty()
+    reconnect_attempts = NumericProperty(6)
+    reconnect_delay = NumericProperty(.1)
+    reconnect_max_delay = NumericProperty(3.)
+    reconnecting = BooleanProperty(False)
+    recovery_rounds = NumericProperty(3)
+    recovery_timeout = NumericProperty(30.)
     preview_texture = ObjectProperty(None, allownone=True)
     preview_resolution = ListProperty()
     preview_fbo = ObjectProperty(None, allownone=True)
@@ -315,6 +362,7 @@ class PyCameraDevice(EventDispatcher):  # pylint: disable=too-many-instance-attr
     connected = BooleanProperty(False)
     supported_resolutions = ListProperty()
     facing = OptionProperty("UNKNOWN", options=["UNKNOWN", "FRONT", "BACK", "EXTERNAL"])
+    fps_ranges = ListProperty()
     java_camera_characteristics = ObjectProperty()
     java_camera_manager = ObjectProperty()
     java_camera_device = ObjectProperty(None, allownone=True)
@@ -330,6 +378,25 @@ class PyCameraDevice(EventDispatcher):  # pylint: disable=too-many-instance-attr
         self._java_capture_session_callback_runnable = Runnable(self._java_capture_session_callback)
         self._java_capture_session_java_callback = MyCaptureSessionCallback(
             self._java_capture_session_callback_runnable)
+
+        self._java_availability_callback_runnable = Runnable(self._java_availability_callback)
+        self._java_availability_java_callback = MyAvailabilityCallback(
+            self._java_availability_callback_runnable)
+        self._session_config = None
+        self._closed = True
+        self._open_pending = False
+        self._closed_device = None
+        self._released_devices = deque(maxlen=8)
+        self._closing_thread = None
+        self._waiting_for_camera = False
+        self._camera_was_unavailable = False
+        self._failed_attempts = 0
+        self._round_attempts = 0
+        self._rounds = 0
+        self._recovery_started = 0.
+        self.frame_times = deque(maxlen=30)
+        self._last_frame_timestamp = 0
+        self._ae_fps_range = None
         self._populate_camera_characteristics()
 
     def on_opened(self, instance):
@@ -344,15 +411,30 @@ class PyCameraDevice(EventDispatcher):  # pylint: disable=too-many-instance-attr
     def on_error(self, instance, error):
         pass
 
+    def on_session_ready(self, instance):
+        pass
+
+    def on_recovered(self, instance, metrics):
+        pass
+
+    def on_recovery_failed(self, instance, metrics):
+        pass
+
     def close(self):
         Logger.info("Attempt to clean up resources")
         self._open_callback = None
+        self._session_config = None
+        self._closed = True
+        self._open_pending = False
+        self._closed_device = self.java_camera_device
+        self.reconnecting = False
+        self._stop_waiting_for_camera()
+        Clock.unschedule(self._reconnect)
+        Clock.unschedule(self._recovery_deadline)
         Clock.unschedule(self._update_preview)
-
-        if hasattr(self, 'handler_thread') and self.handler_thread is not None:
-            self.handler_thread.quit()
-            self.handler_thread = None
-            self.background_handler = None
+        handler_thread = getattr(self, 'handler_thread', None)
+        self.handler_thread = None
+        self.background_handler = None
 
         for attr_name in ('java_camera_device', 'java_capture_session',
                           'java_preview_surface', 'java_capture_request',
@@ -370,6 +452,20 @@ class PyCameraDevice(EventDispatcher):  # pylint: disable=too-many-instance-attr
                     Logger.warning('Error shutting down %s: %s', attr_name, err)
                 setattr(self, attr_name, None)
 
+        if handler_thread is not None:
+            # The looper has to outlive the device for onClosed to be delivered,
+            # it is quit once CLOSED arrives or after a grace period.
+            self._quit_handler_thread()
+            self._closing_thread = handler_thread
+            Clock.schedule_once(self._quit_handler_thread, 3.)
+
+    def _quit_handler_thread(self, *args):
+        Clock.unschedule(self._quit_handler_thread)
+        handler_thread, self._closing_thread = self._closing_thread, None
+
+        if handler_thread is not None:
+            handler_thread.quitSafely()
+
     def _populate_camera_characteristics(self):
         Logger.debug("Populating camera characteristics")
         self.java_stream_configuration_map = self.java_camera_characteristics.get(
@@ -381,6 +477,14 @@ class PyCameraDevice(EventDispatcher):  # pylint: disable=too-many-instance-attr
             self.java_stream_configuration_map.getOutputSizes(SurfaceTexture(0).getClass())]
         Logger.debug("Got supported resolutions")
 
+        # Range.getLower/getUpper are erased to Comparable, parse "[lower, upper]"
+        java_fps_ranges = self.java_camera_characteristics.get(
+            CameraCharacteristics.CONTROL_AE_AVAILABLE_TARGET_FPS_RANGES) or []
+        self.fps_ranges = [
+            (*(int(value) for value in fps_range.toString().strip('[]').split(',')), fps_range)
+            for fps_range in java_fps_ranges]
+        Logger.debug("Got fps ranges")
+
         facing = self.java_camera_characteristics.get(
             CameraCharacteristics.LENS_FACING)
         Logger.debug("Got facing: %s", facing)
@@ -405,6 +509,8 @@ class PyCameraDevice(EventDispatcher):  # pylint: disable=too-many-instance-attr
     def open(self, callback=None, frame_trigger=None):
         self.remote_frame_trigger = frame_trigger
         self._open_callback = callback
+        self._closed = False
+        self._open_pending = True
         self.handler_thread = HandlerThread("camera_background_thread")
         self.handler_thread.start()
 
@@ -416,16 +522,253 @@ class PyCameraDevice(EventDispatcher):  # pylint: disable=too-many-instance-attr
     def _java_state_callback(self):
         action = self._java_state_java_callback.getCameraAction().toString()
         camera_device = self._java_state_java_callback.getCameraDevice()
-        self.java_camera_device = camera_device
         Logger.debug("CALLBACK: camera event %s", action)
 
-        if action in ('OPENED', 'DISCONNECTED', 'CLOSED', 'ERROR', 'UNKNOWN'):
+        if action not in ('OPENED', 'DISCONNECTED', 'CLOSED', 'ERROR', 'UNKNOWN'):
+            raise ValueError(f"Received unknown camera action {action}")
+
+        if action == 'CLOSED':
+            self._java_device_closed(camera_device)
+            return
+
+        # Events are either for the device we hold or for the open we wait on
+        current = _same_device(camera_device, self.java_camera_device)
+        released = any(_same_device(camera_device, device) for device in self._released_devices)
+
+        if released or not (current or self._open_pending):
+            if action == 'OPENED' and not released:
+                # An open that was still pending when close() ran
+                Logger.info("Closing camera %s opened after close()", self.camera_id)
+                self._release_java_device(camera_device)
+            else:
+                Logger.debug("Ignoring %s of a previous camera device", action)
+            return
+
+        if action == 'OPENED':
+            self._open_pending = False
+            self.java_camera_device = camera_device
+        elif action in ('DISCONNECTED', 'ERROR'):
+            if current:
+                self._release_device()
+            else:
+                # The pending open failed
+                self._open_pending = False
+                self._release_java_device(camera_device)
+
+        if action == 'ERROR':
+            self.dispatch('on_error', self, MyStateCallback.camera_error)
+        else:
             self.dispatch(f'on_{action.lower()}', self)
-            self.connected = action == 'OPENED'
+        self.connected = action == 'OPENED'
+
+        if action == 'OPENED' and self._waiting_for_camera:
+            # A reconnect attempt that outlived the recovery deadline
+            self._begin_recovery(reopen=False)
+            return
+
+        if self.reconnecting:
+            if action == 'OPENED':
+                Clock.schedule_once(self._restore_session)
+            elif action in ('DISCONNECTED', 'ERROR'):
+                self._reconnect_failed()
+            return
+
+        if action in ('DISCONNECTED', 'ERROR') and current and self.auto_reconnect \
+                and self._session_config is not None:
+            self._begin_recovery()
+
+        if self._open_callback is not None:
+            self._open_callback(self, action)
+
+    def _java_device_closed(self, camera_device):
+        if _same_device(camera_device, self._closed_device):
+            self._closed_device = None
+            self.connected = False
+            if self._closing_thread is not None:
+                Clock.schedule_once(self._quit_handler_thread)
+            self.dispatch('on_closed', self)
+            return
+
+        # Devices released for a reconnect or closed as stray opens
+        for device in list(self._released_devices):
+            if _same_device(camera_device, device):
+                self._released_devices.remove(device)
+        Logger.debug("CLOSED of a released camera device")
+
+    def _release_java_device(self, camera_device):
+        self._released_devices.append(camera_device)
+        try:
+            camera_device.close()
+        except Exception as err:  # pylint: disable=broad-except
+            Logger.warning('Error releasing %s: %s', camera_device, err)
+
+    def _snapshot_session(self):
+        return {
+            'ae_mode': self.ae_mode,
+            'af_mode': self.af_mode,
+            'flashlight': self.flashlight,
+            'fps': self.fps,
+            'resolution': tuple(self.preview_resolution),
+            'targets': [self.java_preview_surface],
+        }
+
+    def _release_device(self):
+        """Drop the capture session and camera device, but keep the
+        texture, fbo and SurfaceTexture so a reconnect can reuse them.
+        """
+        Clock.unschedule(self._update_preview)
+        self.frame_times.clear()
+        self._last_frame_timestamp = 0
+        session, self.java_capture_session = self.java_capture_session, None
+        device, self.java_camera_device = self.java_camera_device, None
+
+        if session is not None:
+            try:
+                session.close()
+            except Exception as err:  # pylint: disable=broad-except
+                Logger.warning('Error releasing %s: %s', session, err)
+
+        if device is not None:
+            self._release_java_device(device)
+
+    @mainthread
+    def _begin_recovery(self, reopen=True):
+        if self._closed:
+            return
+
+        if not self._waiting_for_camera:
+            self._recovery_started = perf_counter()
+            self._failed_attempts = 0
+            self._rounds = 0
+        self._stop_waiting_for_camera()
+
+        Logger.warning("Camera %s lost, trying to reconnect", self.camera_id)
+        self.reconnecting = True
+        self._rounds += 1
+        self._round_attempts = 0
+        Clock.unschedule(self._recovery_deadline)
+        Clock.schedule_once(self._recovery_deadline, self.recovery_timeout)
+
+        if reopen:
+            self._schedule_reconnect(0)
         else:
-            raise ValueError(f"Received unknown camera action {action}")
+            self._restore_session()
+
+    def _reconnect_failed(self):
+        self._failed_attempts += 1
+        self._round_attempts += 1
+        self._schedule_reconnect()
 
-        self._open_callback(self, action)
+    def _schedule_reconnect(self, delay=None):
+        if self._round_attempts >= self.reconnect_attempts:
+            self._finish_recovery(False)
+            return
+
+        if delay is None:
+            delay = min(self.reconnect_delay * 2 ** (self._round_attempts - 1),
+                        self.reconnect_max_delay)
+        Clock.schedule_once(self._reconnect, delay)
+
+    def _recovery_deadline(self, dt):
+        if self.reconnecting:
+            Logger.warning("Camera %s did not recover within %ss", self.camera_id,
+                           self.recovery_timeout)
+            self._finish_recovery(False)
+
+    def _wait_for_camera(self):
+        """Retry once the camera service reports the camera as available
+        again after having been unavailable, e.g. when the app holding it
+        lets go."""
+        if self._waiting_for_camera or self.background_handler is None:
+            return
+
+        self._waiting_for_camera = True
+        self._camera_was_unavailable = False
+        self.java_camera_manager.registerAvailabilityCallback(
+            self._java_availability_java_callback, self.background_handler)
+
+    def _stop_waiting_for_camera(self):
+        if self._waiting_for_camera:
+            self._waiting_for_camera = False
+            self.java_camera_manager.unregisterAvailabilityCallback(
+                self._java_availability_java_callback)
+
+    def _java_availability_callback(self):
+        callback = self._java_availability_java_callback
+        if callback.getCameraId() != self.camera_id:
+            return
+
+        # Registering reports the current state right away, only an
+        # unavailable -> available transition means the camera was let go.
+        if not callback.isCameraAvailable():
+            self._camera_was_unavailable = True
+        elif self._camera_was_unavailable:
+            self._camera_was_unavailable = False
+            Clock.schedule_once(self._resume_recovery)
+
+    def _resume_recovery(self, dt):
+        if self._waiting_for_camera and self._session_config is not None:
+            Logger.info("Camera %s is available again", self.camera_id)
+            self._begin_recovery()
+
+    def _reconnect(self, dt):
+        if not self.reconnecting or self.background_handler is None:
+            return
+
+        Logger.info("Reconnecting camera %s, attempt %s", self.camera_id,
+                    self._failed_attempts + 1)
+        self._open_pending = True
+        try:
+            self.java_camera_manager.openCamera(self.camera_id,
+                                                self._java_state_java_callback,
+                                                self.background_handler)
+        except Exception as err:  # pylint: disable=broad-except
+            Logger.warning("Reconnecting camera %s failed: %s", self.camera_id, err)
+            self._open_pending = False
+            self._reconnect_failed()
+
+    def _restore_session(self, *args):
+        config = self._session_config
+        if not self.reconnecting or config is None or self.java_camera_device is None:
+            return
+
+        self.ae_mode = config['ae_mode']
+        self.af_mode = config['af_mode']
+        self.flashlight = config['flashlight']
+        self.fps = config['fps']
+        self._create_session(config['targets'])
+
+    @mainthread
+    def _finish_recovery(self, recovered):
+        if not self.reconnecting:
+            return
+
+        metrics = {'time_to_recover': perf_counter() - self._recovery_started,
+                   'failed_attempts': self._failed_attempts,
+                   'rounds': self._rounds}
+        self.reconnecting = False
+        self.last_recovery = dict(metrics, recovered=recovered)
+        Clock.unschedule(self._reconnect)
+        Clock.unschedule(self._recovery_deadline)
+
+        if recovered:
+            Logger.info("Camera %s recovered in %.3fs after %s failed attempts",
+                        self.camera_id, metrics['time_to_recover'], metrics['failed_attempts'])
+            self.dispatch('on_recovered', self, metrics)
+        else:
+            self._release_device()
+
+            if self._rounds < self.recovery_rounds:
+                Logger.error("Camera %s could not be recovered after %s attempts, "
+                             "waiting for it to become available", self.camera_id,
+                             metrics['failed_attempts'])
+                self._wait_for_camera()
+            else:
+                Logger.error("Camera %s could not be recovered after %s rounds, giving up",
+                             self.camera_id, self._rounds)
+                # A reconnect still in flight gets closed when it opens
+                self._open_pending = False
+            self.dispatch('on_recovery_failed', self, metrics)
 
     def start_preview(self, resolution):
         if isinstance(resolution, list):
@@ -453,13 +796,28 @@ class PyCameraDevice(EventDispatcher):  # pylint: disable=too-many-instance-attr
         self.java_preview_surface_texture = SurfaceTexture(int(self.preview_texture.id))
         self.java_preview_surface_texture.setDefaultBufferSize(*java_resolution_list)
         self.java_preview_surface = Surface(self.java_preview_surface_texture)
+        self._create_session([self.java_preview_surface])
+
+        return self.preview_fbo.texture
+
+    def _create_session(self, targets):
+        self._build_capture_request(targets)
+        self.java_camera_device.createCaptureSession(self.java_surface_list,
+                                                     self._java_capture_session_java_callback,
+                                                     self.background_handler)
+
+    def _build_capture_request(self, targets):
         self.java_capture_request = self.java_camera_device.createCaptureRequest(
                 CameraDevice.TEMPLATE_PREVIEW)
-        self.java_capture_request.addTarget(self.java_preview_surface)
-        self.java_capture_request.set(CaptureRequest.CONTROL_AF_MODE,
-                                      ControlAfMode.CONTROL_AF_MODE_CONTINUOUS_PICTURE.value)
-        self.java_capture_request.set(CaptureRequest.CONTROL_AE_MODE,
-                                      ControlAeMode.CONTROL_AE_MODE_ON.value)
+        self.java_surface_list = ArrayList()
+
+        for target in targets:
+            self.java_capture_request.addTarget(target)
+            self.java_surface_list.add(target)
+
+        self.java_capture_request.set(CaptureRequest.CONTROL_AF_MODE, self.af_mode)
+        self.java_capture_request.set(CaptureRequest.CONTROL_AE_MODE, self.ae_mode)
+        self._apply_fps_range()
 
         if self.flashlight and self.facing == 'BACK':
             self.java_capture_request.set(CaptureRequest.CONTROL_AE_MODE,
@@ -468,14 +826,83 @@ class PyCameraDevice(EventDispatcher):  # pylint: disable=too-many-instance-attr
                                           CaptureRequest.FLASH_MODE_TORCH)
             Logger.debug("Flashlight is now supposed to be on")
 
-        self.java_surface_list = ArrayList()
-        self.java_surface_list.add(self.java_preview_surface)
+    def effective_fps(self, fps=None):
+        """`fps` (default: the requested one) capped at the fastest fps
+        range, the camera never delivers faster than that."""
+        fps = self.fps if fps is None else fps
+        if self.fps_ranges:
+            fps = min(fps, max(upper for _, upper, _ in self.fps_ranges))
+        return fps
+
+    def _apply_fps_range(self):
+        # Only constrain auto exposure when running below the fastest range,
+        # the preview template picks its own range otherwise.
+        ranges = self.fps_ranges
+        self._ae_fps_range = None
+        if not ranges:
+            return
 
-        self.java_camera_device.createCaptureSession(self.java_surface_list,
-                                                     self._java_capture_session_java_callback,
-                                                     self.background_handler)
+        fastest = max(upper for _, upper, _ in ranges)
+        if self.fps >= fastest:
+            # Assume the template's range may slow down as far as any of the fastest ones
+            self._ae_fps_range = (min(lower for lower, upper, _ in ranges if upper == fastest),
+                                  fastest)
+            return
 
-        return self.preview_fbo.texture
+        fitting = [r for r in ranges if r[1] <= self.fps] or ranges
+        lower, upper, fps_range = max(fitting, key=lambda r: (r[1], r[0]))
+        self._ae_fps_range = (lower, upper)
+        self.java_capture_request.set(CaptureRequest.CONTROL_AE_TARGET_FPS_RANGE, fps_range)
+
+    def reconfigure(self, resolution=None, fps=None):
+        """Change fps and preview resolution of the running session without
+        reopening the camera. The texture and fbo are kept, the fbo scales a
+        smaller buffer back up to its size.
+
+        Returns False if there is no live session to change, e.g. before
+        the first READY or while reconnecting.
+        """
+        if self.java_capture_session is None or self.reconnecting:
+            return False
+
+        self.frame_times.clear()
+        self._last_frame_timestamp = 0
+        fps_changed = fps is not None and fps != self.fps
+
+        if fps_changed:
+            self.fps = fps
+            Clock.unschedule(self._update_preview)
+            Clock.schedule_interval(self._update_preview, 1. / fps)
+
+        if resolution is not None and tuple(resolution) != tuple(self.preview_resolution):
+            Logger.info("Reconfiguring preview to %s at %s fps", resolution, self.fps)
+            self.preview_resolution = resolution
+            self.java_preview_surface_texture.setDefaultBufferSize(*resolution)
+            # Surfaces are sized when the session is configured
+            self._create_session([self.java_preview_surface])
+        elif fps_changed:
+            Logger.info("Reconfiguring preview to %s fps", self.fps)
+            self._build_capture_request([self.java_preview_surface])
+            self.java_capture_session.setRepeatingRequest(self.java_capture_request.build(),
+                                                          None, None)
+
+        # An fps change gets no new READY, keep a reconnect from restoring old settings
+        self._session_config = self._snapshot_session()
+        return True
+
+    def frame_load(self):
+        """Mean time between camera frames divided by the frame budget,
+        None until enough frames were measured.
+
+        The budget is the lower bound of the auto exposure fps range in use,
+        auto exposure may slow down to it in low light without the device
+        being under load.
+        """
+        if len(self.frame_times) < self.frame_times.maxlen // 2:
+            return None
+
+        fps = self._ae_fps_range[0] if self._ae_fps_range else self.effective_fps()
+        return sum(self.frame_times) / len(self.frame_times) * max(1, fps)
 
     def _prepare_preview_fbo(self, resolution):
         self.preview_fbo = Fbo(size=resolution)
@@ -548,21 +975,40 @@ class PyCameraDevice(EventDispatcher):  # pylint: disable=too-many-instance-attr
             self.java_capture_session = MyCaptureSessionCallback.camera_capture_session
             self.java_capture_session.setRepeatingRequest(self.java_capture_request.build(),
                                                           None, None)
+            Clock.unschedule(self._update_preview)
             Clock.schedule_interval(self._update_preview, 1. / self.fps)
 
+            if self.reconnecting:
+                Clock.unschedule(self._recovery_deadline)
+                self._finish_recovery(True)
+            self._session_config = self._snapshot_session()
+            self.dispatch('on_session_ready', self)
+
     def _update_preview(self, dt):
         self.java_preview_surface_texture.updateTexImage()
+        timestamp = self.java_preview_surface_texture.getTimestamp()
+
+        # updateTexImage keeps the last frame when the camera has no new one
+        if timestamp != self._last_frame_timestamp:
+            if self._last_frame_timestamp:
+                self.frame_times.append((timestamp - self._last_frame_timestamp) / 1e9)
+            self._last_frame_timestamp = timestamp
+
         self.preview_fbo.ask_update()
         self.preview_fbo.draw()
         self.remote_frame_trigger()
 
 
 class Camera2Widget(Widget):
+    __events__ = ('on_analysis_frame', )
     _rect_pos = ListProperty([0, 0])
     _rect_size = ListProperty([1, 1])
+    adaptive_quality = BooleanProperty(False)
+    analysis_rate = NumericProperty(0)
     camera_angle = NumericProperty(90)
     flashlight = BooleanProperty(False)
     fps = NumericProperty(30)
+    quality = ObjectProperty(None, allownone=True)
     resolution = ListProperty()
     resolutions = ListProperty()
     rotation = NumericProperty()
@@ -570,32 +1016,53 @@ class Camera2Widget(Widget):
     texture = ObjectProperty(None, allownone=True)
 
     def __init__(self, **kwargs):
+        self.camera_object = None
+        self.quality = QualityController(thermal_source=ThermalMonitor(),
+                                         frame_load_source=self._frame_load,
+                                         apply=self.apply_quality)
         super().__init__(**kwargs)
         self.device_rotation = TiltDetector()
         self.camera_interface = PyCameraInterface()
         self.cameras_to_use = {v.facing: v for v in self.camera_interface.cameras}
+        self._analysis_rate = 0
+        self._last_analysis = 0.
+        self.on_analysis_rate(self, self.analysis_rate)
+
+    def on_analysis_frame(self, texture):
+        pass
 
     def start_camera(self, instance=None):
         request_permissions([Permission.CAMERA], self._start_camera)
 
     def _start_camera(self, _, permissions):
-        if permissions and permissions[0] and self.target_camera in self.cameras_to_use.keys():
-            self.camera_object = self.cameras_to_use[self.target_camera]
-            self.camera_object.flashlight = self.flashlight
-            self.camera_object.camera_angle = self.camera_angle
-            self.camera_object.fps = self.fps
+        if permissions and permissions[0]:
+            camera = self._select_camera()
 
-            self.resolutions = rs = self.camera_object.supported_resolutions
-            self.resolution = self.resolution or get_suitable_camera_size(rs)
-            self.device_rotation.enable()
-
-            self.camera_object.open(callback=self._stream_camera_open_callback,
-                                    frame_trigger=self.update)
-            return
+            if camera is not None:
+                self.camera_object = camera
+                self.device_rotation.enable()
+                camera.open(callback=self._stream_camera_open_callback,
+                            frame_trigger=self.update)
+                return
 
         Logger.warning("Can't connect with %s camera", self.target_camera)
 
+    def _select_camera(self):
+        camera = self.cameras_to_use.get(self.target_camera)
+
+        if camera is not None:
+            camera.flashlight = self.flashlight
+            camera.camera_angle = self.camera_angle
+            camera.fps = self.fps
+
+            self.resolutions = rs = camera.supported_resolutions
+            self.resolution = self.resolution or get_suitable_camera_size(rs)
+
+        return camera
+
     def stop_camera(self, instance=None):
+        self.quality.stop()
+
         if self.camera_object is not None:
             self.device_rotation.disable()
             self.camera_object.close()
@@ -609,23 +1076,72 @@ class Camera2Widget(Widget):
     @mainthread
     def _stream_camera_open_callback(self, camera, action):
         if action == 'OPENED':
-            w, h = self.resolution
-            aspect_width = self.width
-            aspect_height = self.width * h / w
-
-            if aspect_height < self.height:
-                aspect_height = self.height
-                aspect_width = aspect_height * w / h
-
-            self._rect_pos = [self.center_x - aspect_width / 2,
-                              self.center_y - aspect_height / 2]
-            self._rect_size = [aspect_width, aspect_height]
+            self._layout_preview()
             self.texture = camera.start_preview(self.resolution)
+            self._start_quality_control()
+
+    def _start_quality_control(self):
+        self.quality.reset()
+        self.on_analysis_rate(self, self.analysis_rate)
+
+        if self.adaptive_quality:
+            self.quality.start()
+
+    def on_adaptive_quality(self, instance, value):
+        if not value:
+            self.quality.stop()
+        elif self.camera_object is not None:
+            self.quality.start()
+
+    def on_analysis_rate(self, instance, value):
+        self._analysis_rate = value * self.quality.tier.analysis_scale
+
+    def _frame_load(self):
+        return None if self.camera_object is None else self.camera_object.frame_load()
+
+    def apply_quality(self, tier):
+        """Scale fps, preview resolution and analysis rate by `tier`,
+        relative to the ones requested on the widget. Returns False if the
+        running session could not take the change."""
+        camera = self.camera_object
+        if camera is None:
+            return False
+
+        resolution = get_scaled_camera_size(camera.supported_resolutions, self.resolution,
+                                            tier.resolution_scale)
+        # Scale what the camera can deliver, a 60 fps request on a 30 fps
+        # camera would otherwise only drop below 30 on the last tier
+        fps = max(1, camera.effective_fps(self.fps) * tier.fps_scale)
+        if not camera.reconfigure(resolution=resolution, fps=fps):
+            return False
+
+        self._analysis_rate = self.analysis_rate * tier.analysis_scale
+        Logger.info("Quality tier %s: %s at %s fps", tier.name, resolution, camera.fps)
+        return True
+
+    def _layout_preview(self):
+        w, h = self.resolution
+        aspect_width = self.width
+        aspect_height = self.width * h / w
+
+        if aspect_height < self.height:
+            aspect_height = self.height
+            aspect_width = aspect_height * w / h
+
+        self._rect_pos = [self.center_x - aspect_width / 2,
+                          self.center_y - aspect_height / 2]
+        self._rect_size = [aspect_width, aspect_height]
 
     def update(self):
         self.rotation = self.device_rotation.angle
         self.canvas.ask_update()
 
+        if self._analysis_rate > 0:
+            now = perf_counter()
+            if now - self._last_analysis >= 1. / self._analysis_rate:
+                self._last_analysis = now
+                self.dispatch('on_analysis_frame', self.texture)
+
     def on_flashlight(self, instance, value):
         self.stop_camera()
         self.start_camera()
@@ -642,6 +1158,223 @@ class Camera2Layout(RelativeLayout):
         self.ids.camera.stop_camera()
 
 
+CapturedFrame = namedtuple('CapturedFrame', ('size', 'pixels', 'colorfmt'))
+
+
+class CameraError(Exception):
+    """Raised when the camera reports an unusable state while awaited."""
+
+
+def _resolve(future, result=None, error=None):
+    if future.done():
+        return
+
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+async def request_camera_permission(timeout=30.):
+    """Awaitable version of :func:`request_permissions` for the camera."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def callback(_, grants):
+        loop.call_soon_threadsafe(_resolve, future, bool(grants and grants[0]))
+
+    request_permissions([Permission.CAMERA], callback)
+    return await asyncio.wait_for(future, timeout)
+
+
+class AsyncCameraDevice:
+    """Awaitable facade over :class:`PyCameraDevice`.
+
+    Java state callbacks arrive on the camera handler thread, they are
+    forwarded to the running asyncio loop so every coroutine here resumes
+    on the loop that awaited it (the Kivy main thread under
+    ``App.async_run``).
+    """
+
+    def __init__(self, device, timeout=5.):
+        self.device = device
+        self.timeout = timeout
+
+    async def open(self, frame_trigger=None, timeout=None):
+        """Open the camera and wait for ``OPENED``.
+
+        The device is closed again if it errors, times out or the
+        awaiting task gets cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def callback(_, action):
+            if action == 'OPENED':
+                loop.call_soon_threadsafe(_resolve, future, self.device)
+            else:
+                error = CameraError(f"Camera {self.device.camera_id} reported {action}")
+                loop.call_soon_threadsafe(_resolve, future, None, error)
+
+        self.device.open(callback=callback, frame_trigger=frame_trigger or (lambda: None))
+
+        try:
+            return await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        except BaseException:
+            self.close()
+            raise
+
+    async def start_preview(self, resolution, timeout=None):
+        """Start the preview stream and wait for the capture session to
+        become ready. Returns the texture of the preview fbo.
+
+        On failure the device stays open, so another resolution can be
+        tried without reopening it.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def on_ready(*_):
+            loop.call_soon_threadsafe(_resolve, future, True)
+
+        self.device.fbind('on_session_ready', on_ready)
+        try:
+            texture = self.device.start_preview(resolution)
+            await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        finally:
+            self.device.funbind('on_session_ready', on_ready)
+
+        return texture
+
+    def close(self):
+        self.device.close()
+
+    async def aclose(self, timeout=None):
+        """Close the camera and wait until it reports ``CLOSED``."""
+        device = self.device
+        if device.java_camera_device is None:
+            device.close()
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def on_closed(*_):
+            loop.call_soon_threadsafe(_resolve, future, True)
+
+        device.fbind('on_closed', on_closed)
+        try:
+            device.close()
+            await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            Logger.warning("Camera %s did not report CLOSED in time", device.camera_id)
+        finally:
+            device.funbind('on_closed', on_closed)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+class AsyncCamera2:
+    """Awaitable lifecycle for a :class:`Camera2Widget`.
+
+    Usage::
+
+        async with AsyncCamera2(root.ids.camera) as camera:
+            await camera.start()
+            frame = await camera.capture()
+    """
+
+    def __init__(self, widget, timeout=5.):
+        self.widget = widget
+        self.timeout = timeout
+        self.device = None
+        self._frame_waiters = []
+
+    async def start(self, timeout=None, permission_timeout=30.):
+        """Request permission, open the target camera and start the preview.
+        Returns the preview texture which is also set on the widget.
+
+        `timeout` covers opening the camera and starting the preview, the
+        user gets `permission_timeout` to answer the permission dialog.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        widget = self.widget
+
+        if not await request_camera_permission(permission_timeout):
+            raise CameraError("Camera permission denied")
+
+        camera = widget._select_camera()  # pylint: disable=protected-access
+        if camera is None:
+            raise CameraError(f"Can't connect with {widget.target_camera} camera")
+
+        widget.camera_object = camera
+        widget.device_rotation.enable()
+        self.device = AsyncCameraDevice(camera, timeout=timeout)
+
+        try:
+            await self.device.open(frame_trigger=self._on_frame)
+            widget._layout_preview()  # pylint: disable=protected-access
+            widget.texture = await self.device.start_preview(widget.resolution)
+            widget._start_quality_control()  # pylint: disable=protected-access
+        except BaseException:
+            self.stop()
+            raise
+
+        return widget.texture
+
+    async def capture(self, timeout=None):
+        """Wait for the next preview frame and return its pixels."""
+        if self.device is None:
+            raise CameraError("Camera is not started")
+
+        future = asyncio.get_running_loop().create_future()
+        self._frame_waiters.append(future)
+
+        try:
+            await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        finally:
+            if future in self._frame_waiters:
+                self._frame_waiters.remove(future)
+
+        fbo = self.device.device.preview_fbo
+        return CapturedFrame(tuple(fbo.size), fbo.pixels, 'rgba')
+
+    def stop(self):
+        if self._release() is not None:
+            self.widget.stop_camera()
+
+    async def aclose(self, timeout=None):
+        """Stop the camera and wait until the device reports ``CLOSED``."""
+        device = self._release()
+        if device is not None:
+            await device.aclose(timeout)
+            self.widget.stop_camera()
+
+    def _release(self):
+        for future in self._frame_waiters:
+            future.cancel()
+        self._frame_waiters = []
+        device, self.device = self.device, None
+        return device
+
+    def _on_frame(self):
+        self.widget.update()
+        waiters, self._frame_waiters = self._frame_waiters, []
+
+        for future in waiters:
+            _resolve(future, True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
 if __name__ == '__main__':
     class MyApp(App):
         def build(self):
@@ -1,10 +1,11 @@
-from kivy.clock import mainthread
-from kivy.factory import Factory
 from kivy.lang import Builder
-from kivy.properties import BooleanProperty, ListProperty
+from kivy.metrics import dp
+from kivy.properties import (BooleanProperty, ListProperty, NumericProperty,
+                             ObjectProperty)
 from kivy.uix.behaviors import ButtonBehavior
 from kivy.uix.label import Label
-from kivy.uix.spinner import Spinner
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 
 __all__ = ('ResolutionPicker', 'CameraRSButton')
 
@@ -12,22 +13,31 @@ Builder.load_string('''
 <ResolutionPicker>:
     text:(f'{self.selected_resolution[0]} x {self.selected_resolution[1]}' \
             if self.selected_resolution else '')
-    values: [f'{res[0]} x {res[1]}' for res in self.available_resolutions]
-    background_color: 1, .8, 0, 1
-    background_normal: ''
     font_size: dp(9)
     color: 0, 0, 0, 1
     height: dp(30)
-    on_submit: self.change_resolution(args[1])
-    on_text: self.submit()
-    option_cls: 'CameraRSButton'
     size_hint: None, None
+    canvas.before:
+        Color:
+            rgba: 1, .8, 0, 1
+        Rectangle:
+            size: self.size
+            pos: self.pos
+
+<ResolutionList>:
+    viewclass: 'CameraRSButton'
+    size_hint: None, None
+    bar_width: dp(2)
+    RecycleBoxLayout:
+        default_size: None, dp(30)
+        default_size_hint: 1, None
+        size_hint_y: None
+        height: self.minimum_height
+        orientation: 'vertical'
 
 <CameraRSButton>:
     font_size: dp(9)
     color: [int(not self.active)] * 3
-    height: 30
-    size_hint: None, None
     canvas.before:
         Color:
             rgba: (1, .8, 0, .7) if self.active else (0, 0, 0, .5)
@@ -37,41 +47,105 @@ Builder.load_string('''
 ''')
 
 
-class ResolutionPicker(Spinner):
+class ResolutionList(RecycleView):
+    picker = ObjectProperty(None, allownone=True)
+
+    def on_touch_down(self, touch):
+        if not self.collide_point(*touch.pos):
+            self.picker.dismiss()
+            return True
+        return super().on_touch_down(touch)
+
+
+class ResolutionPicker(ButtonBehavior, Label):
+    """Spinner-like picker listing the resolutions in a RecycleView, so only
+    the visible rows get widgets no matter how many sizes the camera has.
+    """
     __events__ = ('on_submit', )
 
+    is_open = BooleanProperty(False)
+    max_rows = NumericProperty(8)
     selected_resolution = ListProperty()
     available_resolutions = ListProperty()
+    values = ListProperty()
 
     def __init__(self, **kwargs):
+        self._list = ResolutionList(picker=self)
+        self._index = {}
+        self._active = None
         super().__init__(**kwargs)
-        self.fbind('selected_resolution', self._update_dropdown)
-        self.first_run = True
+        self.fbind('available_resolutions', self._update_values)
+        self.fbind('selected_resolution', self._update_active)
+        self._update_values()
 
     def change_resolution(self, value):
         self.selected_resolution = value
 
-    @mainthread
-    def _update_dropdown(self, *args):
-        super()._update_dropdown(*args)
-        option_cls = (self.option_cls
-                      if not isinstance(self.option_cls, str)
-                      else Factory.get(self.option_cls))
-        for widget in self._dropdown.container.children:
-            if isinstance(widget, option_cls) and widget.text == self.text:
-                widget.active = True
-                break
-
-    def submit(self):
-        try:
-            index = self.values.index(self.text)
-            if self.first_run:
-                self.first_run = False
-                return
-        except ValueError:
+    def _update_values(self, *args):
+        resolutions = [tuple(res) for res in self.available_resolutions]
+        self._index = {res: index for index, res in enumerate(resolutions)}
+        self.values = [f'{res[0]} x {res[1]}' for res in resolutions]
+        self._active = None
+        self._list.data = [{'text': text, 'index': index, 'active': False}
+                           for index, text in enumerate(self.values)]
+        self._update_active()
+
+    def _update_active(self, *args):
+        index = self._index.get(tuple(self.selected_resolution))
+        if index == self._active:
+            return
+
+        self._set_row_active(self._active, False)
+        self._set_row_active(index, True)
+        self._active = index
+
+    def _set_row_active(self, index, active):
+        if index is None:
             return
 
+        self._list.data[index]['active'] = active
+        view = self._list.view_adapter.get_visible_view(index)
+        if view is not None:
+            view.active = active
+
+    def on_release(self):
+        if self.is_open:
+            self.dismiss()
+        else:
+            self.open()
+
+    def open(self):
+        window = self.get_parent_window()
+        if window is None or not self.values:
+            return
+
+        rows = min(len(self.values), self.max_rows)
+        self._list.size = max(self.width, dp(80)), rows * dp(30)
+        x, y = self.to_window(*self.pos)
+        top = y - self._list.height
+
+        if top < 0:
+            top = y + self.height
+        self._list.pos = x, top
+
+        if self._active is not None:
+            self._list.scroll_y = 1 - self._active / max(len(self.values) - 1, 1)
+
+        window.add_widget(self._list)
+        self.is_open = True
+
+    def dismiss(self):
+        if self._list.parent is not None:
+            self._list.parent.remove_widget(self._list)
+        self.is_open = False
+
+    def select(self, index):
+        self.dismiss()
         selected_resolution = self.available_resolutions[index]
+
+        if self._index.get(tuple(self.selected_resolution)) == index:
+            return
+
         self.selected_resolution = selected_resolution
         self.dispatch('on_submit', selected_resolution)
 
@@ -79,8 +153,19 @@ class ResolutionPicker(Spinner):
         pass
 
 
-class CameraRSButton(ButtonBehavior, Label):
+class CameraRSButton(RecycleDataViewBehavior, ButtonBehavior, Label):
     active = BooleanProperty(False)
+    index = NumericProperty(-1)
+    picker = ObjectProperty(None, allownone=True)
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.index = index
+        self.picker = rv.picker
+        return super().refresh_view_attrs(rv, index, data)
+
+    def on_release(self):
+        if self.picker is not None:
+            self.picker.select(self.index)
 
 
 if __name__ == '__main__':
@@ -88,6 +173,8 @@ if __name__ == '__main__':
 
     class MyApp(App):
         def build(self):
-            return ResolutionPicker()
+            return ResolutionPicker(
+                available_resolutions=[(w, w * 9 // 16) for w in range(320, 4160, 80)],
+                selected_resolution=[1920, 1080])
 
     MyApp().run()
@@ -0,0 +1,187 @@
+from collections import namedtuple
+from enum import Enum
+from time import perf_counter
+
+from kivy.clock import Clock
+from kivy.event import EventDispatcher
+from kivy.properties import (AliasProperty, ListProperty, NumericProperty,
+                             ObjectProperty)
+
+__all__ = ('QualityController', 'QualityPolicy', 'QualityTier', 'SimulatedSource',
+           'ThermalStatus')
+
+
+class ThermalStatus(Enum):
+    """Values copied from PowerManager api doc."""
+    THERMAL_STATUS_NONE = 0
+    THERMAL_STATUS_LIGHT = 1
+    THERMAL_STATUS_MODERATE = 2
+    THERMAL_STATUS_SEVERE = 3
+    THERMAL_STATUS_CRITICAL = 4
+    THERMAL_STATUS_EMERGENCY = 5
+    THERMAL_STATUS_SHUTDOWN = 6
+
+
+QualityTier = namedtuple('QualityTier', ('name', 'fps_scale', 'resolution_scale',
+                                         'analysis_scale'))
+
+DEFAULT_TIERS = (
+    QualityTier('high', 1., 1., 1.),
+    QualityTier('medium', .75, .75, .5),
+    QualityTier('low', .5, .5, .25),
+)
+
+# Frame load is the measured frame time divided by the frame budget,
+# 1.0 means frames arrive exactly on time.
+QualityPolicy = namedtuple('QualityPolicy', (
+    'tiers',            # ordered best to worst
+    'interval',         # seconds between two evaluations
+    'degrade_load',     # frame load at or above which a sample counts as pressure
+    'recover_load',     # frame load at or below which a sample counts as relief
+    'degrade_thermal',  # thermal status at or above which a sample counts as pressure
+    'recover_thermal',  # thermal status at or below which a sample counts as relief
+    'critical_thermal',  # thermal status that drops straight to the last tier
+    'degrade_after',    # consecutive pressure samples before stepping down
+    'recover_after',    # consecutive relief samples before stepping up
+    'min_dwell',        # seconds to stay on a tier before stepping up again
+    'history_size',     # decisions kept in QualityController.history
+), defaults=(DEFAULT_TIERS, 1., 1.25, .9,
+             ThermalStatus.THERMAL_STATUS_MODERATE.value,
+             ThermalStatus.THERMAL_STATUS_LIGHT.value,
+             ThermalStatus.THERMAL_STATUS_CRITICAL.value,
+             2, 5, 10., 50))
+
+
+class QualityController(EventDispatcher):
+    """Steps through the tiers of a :class:`QualityPolicy` from periodic
+    thermal and frame load samples.
+
+    Stepping down needs `degrade_after` pressure samples in a row, stepping
+    up needs `recover_after` relief samples in a row and `min_dwell` seconds
+    on the current tier, which keeps the controller from oscillating.
+    Samples in between the two thresholds reset both counters.
+
+    `apply` is called with the new tier and returns whether it was applied.
+    A refused tier is not committed and gets requested again on the next
+    sample, e.g. once a reconnecting camera has its session back.
+    """
+    __events__ = ('on_decision', )
+
+    apply = ObjectProperty(None, allownone=True)
+    frame_load_source = ObjectProperty(None, allownone=True)
+    history = ListProperty()
+    policy = ObjectProperty(QualityPolicy())
+    thermal_source = ObjectProperty(None, allownone=True)
+    tier_index = NumericProperty(0)
+
+    def _get_tier(self):
+        return self.policy.tiers[self.tier_index]
+
+    tier = AliasProperty(_get_tier, bind=('policy', 'tier_index'))
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._pressure = 0
+        self._relief = 0
+        self._last_change = None
+
+    def on_decision(self, decision):
+        pass
+
+    def start(self):
+        self.stop()
+        Clock.schedule_interval(self.step, self.policy.interval)
+
+    def stop(self):
+        Clock.unschedule(self.step)
+
+    def reset(self):
+        self.tier_index = 0
+        self.history = []
+        self._pressure = 0
+        self._relief = 0
+        self._last_change = None
+
+    def step(self, dt=None, now=None):
+        """Take one sample from the sources and apply the resulting tier.
+        Returns the decision, or None if the tier was kept or refused.
+        """
+        now = perf_counter() if now is None else now
+        thermal = self.thermal_source() if self.thermal_source else 0
+        load = self.frame_load_source() if self.frame_load_source else None
+        index, reason = self.evaluate(thermal, load, now)
+
+        if index == self.tier_index:
+            return None
+
+        tier = self.policy.tiers[index]
+        if self.apply is not None and not self.apply(tier):
+            return None
+
+        decision = {'time': now, 'from': self.tier.name, 'to': tier.name,
+                    'reason': reason, 'thermal': thermal, 'load': load}
+        self.tier_index = index
+        self._pressure = self._relief = 0
+        self._last_change = now
+        self.history = (self.history + [decision])[-self.policy.history_size:]
+        self.dispatch('on_decision', decision)
+        return decision
+
+    def evaluate(self, thermal, load, now):
+        """Return the tier index the sample asks for and why."""
+        policy = self.policy
+        index = self.tier_index
+        last = len(policy.tiers) - 1
+        overloaded = load is not None and load >= policy.degrade_load
+
+        if thermal >= policy.critical_thermal:
+            return last, 'thermal critical'
+
+        if thermal >= policy.degrade_thermal or overloaded:
+            self._pressure += 1
+            self._relief = 0
+        elif thermal <= policy.recover_thermal and (load is None or load <= policy.recover_load):
+            self._relief += 1
+            self._pressure = 0
+        else:
+            self._pressure = self._relief = 0
+
+        if self._pressure >= policy.degrade_after and index < last:
+            return index + 1, 'frame time' if overloaded else 'thermal'
+
+        if self._relief >= policy.recover_after and index > 0 \
+                and (self._last_change is None or now - self._last_change >= policy.min_dwell):
+            return index - 1, 'recovered'
+
+        return index, None
+
+
+class SimulatedSource:
+    """Stand-in for the thermal and frame load sources, e.g. on Linux."""
+
+    def __init__(self, thermal=0, load=1.):
+        self.thermal = thermal
+        self.load = load
+
+    def thermal_status(self):
+        return self.thermal
+
+    def frame_load(self):
+        return self.load
+
+
+if __name__ == '__main__':
+    source = SimulatedSource()
+    controller = QualityController(thermal_source=source.thermal_status,
+                                   frame_load_source=source.frame_load)
+    # (seconds, thermal status, frame load) of a session that heats up and cools down
+    session = [(20, 0, 1.), (10, 1, 1.4), (20, 2, 1.1), (10, 4, 1.), (60, 0, .8)]
+    clock = 0
+
+    for duration, source.thermal, source.load in session:
+        for _ in range(duration):
+            clock += 1
+            decision = controller.step(now=clock)
+            if decision:
+                print(f"{clock:4}s {decision['from']:>6} -> {decision['to']:<6} "
+                      f"{decision['reason']}")